@@ -0,0 +1,327 @@
+import sys
+sys.path.append('../')
+
+from utils import combine_buildings_dicts
+from matterport3d_analysis import (buildings_viewpoints_to_regions, buildings_metadata,
+    build_regions_connectivity, remove_uncovered_regions_from_metadata)
+from r2r_analysis import (build_buildings_to_instructions_and_viewpoints,
+    build_region_to_instructions, create_region_based_instructions_combinations)
+
+import os
+import json
+import pickle
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+
+
+"""
+Incremental rebuild of the data/ artifacts. Every node of the pipeline records,
+per building, a hash of its code (the source of the functions it declares),
+its parameters and the slices of its inputs that belong to the building. A run
+only recomputes the buildings whose hash changed, and nodes that do not depend
+on each other run in parallel.
+"""
+# ------------------------------------------------------------------------------
+MANIFEST_PATH = '../data/utils/pipeline_manifest.json'
+# ------------------------------------------------------------------------------
+
+
+def digest(obj):
+    """
+    Returns a sha256 hex digest of a json serializable object, sets included.
+    """
+    serialized = json.dumps(obj, sort_keys=True, default=sorted)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def file_digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def load_artifact(path):
+    if not os.path.exists(path):
+        return {}
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_artifact(artifact, path):
+    if path.endswith('.pkl'):
+        with open(path, 'wb') as file:
+            pickle.dump(artifact, file)
+    else:
+        with open(path, 'w') as file:
+            json.dump(artifact, file)
+
+
+"""
+Raw inputs, each returns {building_id: digest of the files of the building}
+"""
+# ------------------------------------------------------------------------------
+def matterport_house_slices(dataset_dir):
+    slices = {}
+    for building in os.listdir(dataset_dir):
+        segmentations_path = os.path.join(dataset_dir, building, 'house_segmentations')
+        if os.path.isdir(segmentations_path):
+            slices[building] = digest([
+                file_digest(f'{segmentations_path}/{building}.house'),
+                file_digest(f'{segmentations_path}/panorama_to_region.txt')
+            ])
+    return slices
+
+
+def matterport_connectivity_slices(scans_file, connectivity_dir):
+    slices = {}
+    with open(scans_file, 'r') as file:
+        for line in file:
+            building = line.strip()
+            if building:
+                slices[building] = file_digest(f'{connectivity_dir}/{building}_connectivity.json')
+    return slices
+
+
+def r2r_slices(json_files):
+    entries = {}
+    for json_file in json_files:
+        with open(json_file, 'r') as file:
+            for entry in json.load(file):
+                entries.setdefault(entry['scan'], []).append(entry)
+    return {building: digest(entries[building]) for building in entries}
+
+
+def artifact_slices(path):
+    artifact = load_artifact(path)
+    return {building: digest(artifact[building]) for building in artifact}
+# ------------------------------------------------------------------------------
+
+
+def r2r_buildings_to_instructions_and_viewpoints(json_files, save_path='', buildings=None):
+    """
+    Runs build_buildings_to_instructions_and_viewpoints over several R2R splits
+    and combines them.
+    """
+    result = {}
+    for json_file in json_files:
+        result = combine_buildings_dicts(
+            result, build_buildings_to_instructions_and_viewpoints(json_file, buildings)
+        )
+
+    # Save file
+    if save_path:
+        with open(save_path, 'wb') as pickle_file:
+            pickle.dump(result, pickle_file)
+
+    return result
+
+
+def build_data_pipeline(dataset_dir, scans_file, connectivity_dir, r2r_files,
+    num_seqs_per_building, data_dir='../data'):
+    """
+    Declares the nodes producing the data/ artifacts, and the raw inputs they
+    read from Matterport3D and R2R.
+
+    Args:
+        dataset_dir (str): path to house_segmentations directories of matterport3d.
+        scans_file (str.txt): File that contains buildings name in new lines.
+        connectivity_dir (str): Path to directory of Matterport3d connectivities.
+        r2r_files (list(str.json)): R2R splits to use.
+        num_seqs_per_building (int): Instructions sequences per building.
+        data_dir (str, optional): Directory of the artifacts. Defaults to '../data'.
+
+    Returns:
+        (list(dict), dict): Nodes, [{
+                'name': str,
+                'func': callable (accepting save_path and buildings),
+                'code': [callable] (func and the repo functions it calls,
+                    whose source is hashed),
+                'args': dict (path arguments of func),
+                'params': dict (other arguments of func, hashed with the code),
+                'inputs': [str] (names of nodes and raw inputs it reads),
+                'output': str (path of the artifact)
+            }, ...], and raw inputs, {name: (function, args)} returning the
+            {building_id: digest} slices of each raw input.
+    """
+    raw_inputs = {
+        'matterport_house': (matterport_house_slices, (dataset_dir,)),
+        'matterport_connectivity': (matterport_connectivity_slices, (scans_file, connectivity_dir)),
+        'r2r': (r2r_slices, (list(r2r_files),))
+    }
+
+    viewpoints_to_regions_path = f'{data_dir}/utils/buildings_viewpoints_to_regions.json'
+    raw_metadata_path = f'{data_dir}/utils/buildings_metadata_raw.json'
+    r2r_information_path = f'{data_dir}/utils/buildings_to_instructions_and_viewpoints.pkl'
+    regions_to_instructions_path = f'{data_dir}/utils/regions_to_instructions.pkl'
+
+    nodes = [
+        {
+            'name': 'viewpoints_to_regions',
+            'func': buildings_viewpoints_to_regions,
+            'code': [buildings_viewpoints_to_regions],
+            'args': {'dataset_dir': dataset_dir},
+            'params': {},
+            'inputs': ['raw:matterport_house'],
+            'output': viewpoints_to_regions_path
+        },
+        {
+            'name': 'raw_metadata',
+            'func': buildings_metadata,
+            'code': [buildings_metadata],
+            'args': {'dataset_dir': dataset_dir},
+            'params': {},
+            'inputs': ['raw:matterport_house'],
+            'output': raw_metadata_path
+        },
+        {
+            'name': 'r2r_information',
+            'func': r2r_buildings_to_instructions_and_viewpoints,
+            'code': [
+                r2r_buildings_to_instructions_and_viewpoints,
+                build_buildings_to_instructions_and_viewpoints,
+                combine_buildings_dicts
+            ],
+            'args': {'json_files': list(r2r_files)},
+            'params': {},
+            'inputs': ['raw:r2r'],
+            'output': r2r_information_path
+        },
+        {
+            'name': 'regions_connectivity',
+            'func': build_regions_connectivity,
+            'code': [build_regions_connectivity],
+            'args': {
+                'scans_file': scans_file,
+                'connectivity_dir': connectivity_dir,
+                'viewpoints_to_regions_path': viewpoints_to_regions_path
+            },
+            'params': {},
+            'inputs': ['raw:matterport_connectivity', 'viewpoints_to_regions'],
+            'output': f'{data_dir}/regions_connectivity.pkl'
+        },
+        {
+            'name': 'buildings_metadata',
+            'func': remove_uncovered_regions_from_metadata,
+            'code': [remove_uncovered_regions_from_metadata],
+            'args': {
+                'metadata_path': raw_metadata_path,
+                'viewpoints_to_regions_path': viewpoints_to_regions_path
+            },
+            'params': {},
+            'inputs': ['raw_metadata', 'viewpoints_to_regions'],
+            'output': f'{data_dir}/buildings_metadata.json'
+        },
+        {
+            'name': 'regions_to_instructions',
+            'func': build_region_to_instructions,
+            'code': [build_region_to_instructions],
+            'args': {
+                'r2r_informbuildings_to_instructionsation_path': r2r_information_path,
+                'viewpoints_to_regions_path': viewpoints_to_regions_path
+            },
+            'params': {},
+            'inputs': ['r2r_information', 'viewpoints_to_regions'],
+            'output': regions_to_instructions_path
+        },
+        {
+            'name': 'text2map_navigation_instructions',
+            'func': create_region_based_instructions_combinations,
+            'code': [create_region_based_instructions_combinations],
+            'args': {'regions_to_instructions': regions_to_instructions_path},
+            'params': {'num_seqs_per_building': num_seqs_per_building},
+            'inputs': ['regions_to_instructions'],
+            'output': f'{data_dir}/text2map_navigation_instructions.json'
+        },
+    ]
+
+    return nodes, raw_inputs
+
+
+def run_node(node, input_slices, node_manifest):
+    """
+    Recomputes the stale buildings of a node and merges them into its artifact.
+
+    Args:
+        node (dict): Node as declared by build_data_pipeline.
+        input_slices (list(dict)): {building_id: digest} of each node input.
+        node_manifest (dict): {building_id: hash} recorded at the last run.
+
+    Returns:
+        (dict, list(str)): New {building_id: hash} of the node, and the
+        buildings that were recomputed.
+    """
+    code_hash = digest([inspect.getsource(function) for function in node['code']])
+    params_hash = digest(node['params'])
+
+    # Buildings present in all inputs, and their current hashes
+    buildings = set.intersection(*[set(slices) for slices in input_slices])
+    hashes = {
+        building: digest([code_hash, params_hash] + [slices[building] for slices in input_slices])
+        for building in buildings
+    }
+
+    artifact = load_artifact(node['output'])
+    stale = {
+        building for building in buildings
+        if node_manifest.get(building) != hashes[building] or building not in artifact
+    }
+    removed = set(artifact) - buildings
+    if not stale and not removed:
+        return hashes, []
+
+    if stale:
+        result = node['func'](**node['args'], **node['params'], buildings=stale)
+        artifact.update(result)
+    for building in removed:
+        del artifact[building]
+
+    save_artifact(artifact, node['output'])
+    return hashes, sorted(stale)
+
+
+def run_data_pipeline(nodes, raw_inputs, manifest_path=MANIFEST_PATH, max_workers=None):
+    """
+    Runs the pipeline, recomputing only the stale buildings of every node.
+    Nodes whose inputs are all up to date run in parallel.
+
+    Args:
+        nodes (list(dict)): Nodes as declared by build_data_pipeline.
+        raw_inputs (dict): Raw inputs as declared by build_data_pipeline.
+        manifest_path (str.json, optional): Hashes of the last run. Defaults to MANIFEST_PATH.
+        max_workers (int, optional): Parallel nodes. Defaults to the number of CPUs.
+
+    Returns:
+        dict: {node name: [recomputed buildings]}.
+    """
+    manifest = load_artifact(manifest_path)
+    slices = {f'raw:{name}': function(*args) for name, (function, args) in raw_inputs.items()}
+
+    recomputed = {}
+    pending = {node['name']: node for node in nodes}
+    with ProcessPoolExecutor(max_workers) as executor:
+        while pending:
+            # Nodes whose inputs are all built
+            ready = [node for node in pending.values() if all(name in slices for name in node['inputs'])]
+            if not ready:
+                raise ValueError(f'Unresolved inputs in nodes: {sorted(pending)}')
+
+            futures = {
+                node['name']: executor.submit(
+                    run_node, node, [slices[name] for name in node['inputs']],
+                    manifest.get(node['name'], {})
+                )
+                for node in ready
+            }
+            for node in ready:
+                manifest[node['name']], recomputed[node['name']] = futures[node['name']].result()
+                slices[node['name']] = artifact_slices(node['output'])
+                del pending[node['name']]
+                print(f"{node['name']}: {len(recomputed[node['name']])} buildings recomputed")
+
+            # Save progress
+            save_artifact(manifest, manifest_path)
+
+    return recomputed
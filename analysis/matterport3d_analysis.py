@@ -3,7 +3,7 @@ import json
 import pickle
 
 
-def buildings_viewpoints_to_regions(dataset_dir, save_path=''):
+def buildings_viewpoints_to_regions(dataset_dir, save_path='', buildings=None):
     """
     Parses information about the regions in every building from .house files
     and panorama_to_regions files, and returns viewpoint_to_region dictionary.
@@ -11,6 +11,7 @@ def buildings_viewpoints_to_regions(dataset_dir, save_path=''):
     Args:
         dataset_dir (str): path to house_segmentations directories of matterport3d.
         save_path (str.json, optional): Path to save result. Defaults to ''.
+        buildings (set(str), optional): Only parse these buildings. Defaults to all.
 
     Return:
         dict: {
@@ -27,6 +28,8 @@ def buildings_viewpoints_to_regions(dataset_dir, save_path=''):
     result = {}
     # Loop through the buildings directories
     for building in os.listdir(dataset_dir):
+        if buildings is not None and building not in buildings:
+            continue
         building_path = os.path.join(dataset_dir, building)
         if os.path.isdir(building_path):
             
@@ -61,7 +64,7 @@ def buildings_viewpoints_to_regions(dataset_dir, save_path=''):
     return result
 
 
-def buildings_metadata(dataset_dir, save_path=''):
+def buildings_metadata(dataset_dir, save_path='', buildings=None):
     """
     Parses .house file for each building and returns metadata about the levels,
     and the regions that belong to that building.
@@ -69,6 +72,7 @@ def buildings_metadata(dataset_dir, save_path=''):
     Args:
         dataset_dir (str): path to house_segmentations directories of matterport3d.
         save_path (str.json, optional): Path to save result. Defaults to ''.
+        buildings (set(str), optional): Only parse these buildings. Defaults to all.
 
     Returns:
         dict: {
@@ -88,6 +92,8 @@ def buildings_metadata(dataset_dir, save_path=''):
     result = {}
     # Loop through the buildings directories
     for building in os.listdir(dataset_dir):
+        if buildings is not None and building not in buildings:
+            continue
         result[building] = {}
 
         building_path = os.path.join(dataset_dir, building)
@@ -128,7 +134,8 @@ def buildings_metadata(dataset_dir, save_path=''):
     return result
 
 
-def build_regions_connectivity(scans_file, connectivity_dir, viewpoints_to_regions_path, save_path=''):
+def build_regions_connectivity(scans_file, connectivity_dir, viewpoints_to_regions_path, save_path='',
+    buildings=None):
     """
     builds connectivit graphs of regions withing each building.
 
@@ -137,6 +144,7 @@ def build_regions_connectivity(scans_file, connectivity_dir, viewpoints_to_regio
         connectivity_dir (str): Path to directory of Matterport3d connectivities.
         viewpoints_to_regions_path (str.json): Path to the dict.
         save_path (str.pkl, optional): Path to save result. Defaults to ''.
+        buildings (set(str), optional): Only build these buildings. Defaults to all.
 
     Returns:
         dict: {
@@ -155,7 +163,8 @@ def build_regions_connectivity(scans_file, connectivity_dir, viewpoints_to_regio
     building_ids = []
     with open(scans_file, 'r') as file:
         for line in file:
-            building_ids.append(line.strip())
+            if buildings is None or line.strip() in buildings:
+                building_ids.append(line.strip())
 
     # Loop through the 
     connectivity_dict = {}
@@ -199,7 +208,7 @@ def build_regions_connectivity(scans_file, connectivity_dir, viewpoints_to_regio
 
 
 def remove_uncovered_regions_from_metadata(metadata_path, 
-    viewpoints_to_regions_path, save_path = ""):
+    viewpoints_to_regions_path, save_path = "", buildings=None):
     # Load connectivity_graphs viewpoint_to_region
     with open(metadata_path, 'r') as file:
         metadata = json.load(file)
@@ -209,6 +218,8 @@ def remove_uncovered_regions_from_metadata(metadata_path,
     # loop through the buildings
     new_metadata = {}
     for building_id in metadata:
+        if buildings is not None and building_id not in buildings:
+            continue
 
         # collect the covered regions
         covered_regions = set()
@@ -5,12 +5,13 @@ import itertools
 from tqdm import tqdm
 
 
-def build_buildings_to_instructions_and_viewpoints(json_file):
+def build_buildings_to_instructions_and_viewpoints(json_file, buildings=None):
     """
     Loops over instructions, and collects information about the buildings.
 
     Args:
         json_file (str): instructions file.
+        buildings (set(str), optional): Only collect these buildings. Defaults to all.
 
     Returns:
         dict: {
@@ -29,6 +30,8 @@ def build_buildings_to_instructions_and_viewpoints(json_file):
         data = json.load(file)
     
     for entry in data:
+        if buildings is not None and entry['scan'] not in buildings:
+            continue
         buildings_dict.setdefault(
             entry['scan'], 
             {'occurs': 0, 'viewpoints': set(), 'instructions': []}
@@ -91,7 +94,8 @@ def map_coverage_per_building_csv(map_coverage_per_building_dict):
 
 
 def build_region_to_instructions(r2r_informbuildings_to_instructionsation_path,
-                                  viewpoints_to_regions_path, save_path=''):
+                                  viewpoints_to_regions_path, save_path='',
+                                  buildings=None):
     """
     Returns a dictionary that contains each navigation sequences divided into 
     regions, for every building in the dataset.
@@ -99,6 +103,7 @@ def build_region_to_instructions(r2r_informbuildings_to_instructionsation_path,
     Args:
         r2r_informbuildings_to_instructionsation_path (str): Path to pkl file storing r2r analysis. 
         viewpoints_to_regions_path (str): Path to json file.
+        buildings (set(str), optional): Only build these buildings. Defaults to all.
 
     Returns:
         dict: {
@@ -126,6 +131,8 @@ def build_region_to_instructions(r2r_informbuildings_to_instructionsation_path,
     # Loop through the instructions of the building
     result = {}
     for building in r2r_informbuildings_to_instructionsation:
+        if buildings is not None and building not in buildings:
+            continue
         result[building] = {}
         for instruction in r2r_informbuildings_to_instructionsation[building]['instructions']:
             
@@ -165,7 +172,7 @@ def build_region_to_instructions(r2r_informbuildings_to_instructionsation_path,
 
 
 def create_region_based_instructions_combinations(regions_to_instructions,
-    num_seqs_per_building, save_path=''):
+    num_seqs_per_building, save_path='', buildings=None):
     """
     Generates combinations of navigation instructions for each building, such
     that each region in the building is covered at least once, and max number of
@@ -173,6 +180,7 @@ def create_region_based_instructions_combinations(regions_to_instructions,
 
     Args:
         regions_to_instructions (_type_): _description_
+        buildings (set(str), optional): Only generate these buildings. Defaults to all.
 
     Returns:
         dict: {
@@ -200,6 +208,8 @@ def create_region_based_instructions_combinations(regions_to_instructions,
 
     # Iterate over each building in the data with tqdm for progress tracking
     for building_id in tqdm(building_data, desc="Processing buildings"):
+        if buildings is not None and building_id not in buildings:
+            continue
         result[building_id] = []
         regions = building_data[building_id]
 
@@ -1,5 +1,45 @@
+import os
+
+
 class CHATGPT_API:
     MODEL = 'gpt-4-1106-preview'
     SEED = 2481632
     SYSTEM_FINGERPRINT = ...
-    
\ No newline at end of file
+    
+
+class SWEEP:
+    DB_PATH = '../data/sweeps/sweep.db'
+    LEASE_SECONDS = 600
+    MAX_ATTEMPTS = 3
+    POLL_SECONDS = 10
+    WAL = True
+
+
+class PROMPTER:
+    ENCODING = 'verbose'
+
+
+class PROFILING:
+    ENABLED = os.environ.get('TEXT2MAP_PROFILE', '') not in ('', '0')
+    MEMORY = os.environ.get('TEXT2MAP_PROFILE_MEMORY', '') not in ('', '0')
+    CPROFILE_PATH = os.environ.get('TEXT2MAP_PROFILE_CPROFILE', '')
+    REPORT_PATH = os.environ.get('TEXT2MAP_PROFILE_REPORT', 'profile_report.txt')
+    SIZE_BUCKET = 10
+
+
+class SERVER:
+    HOST = '127.0.0.1'
+    PORT = 8765
+    WORKERS = os.cpu_count()
+    SCORE_CACHE_SIZE = 4096
+
+
+class ADAPTIVE:
+    TOLERANCE = 0.05
+    WINDOW = 1
+    MIN_SAMPLES = 2
+
+
+class SHOTS:
+    STRATEGY = 'random'
+    INDEX_PATH = '../data/utils/shots_index.pkl'
@@ -2,19 +2,25 @@ import sys
 sys.path.append('../')
 
 from tqdm import tqdm
-from config import CHATGPT_API
-from prompting_engine.prompter import generate_prompt
-from metrics import edges_similarity, approx_ged
+from config import ADAPTIVE, CHATGPT_API, PROMPTER, SHOTS
+from profiling import profiled, set_building_size
+from prompting_engine.prompter import (generate_prompt, generate_level_prompt,
+    generate_inter_level_prompt, regions_levels, split_instructions_by_level,
+    text2map_navigation_instructions)
+from prompting_engine.shots_index import load_shots_index, similar_buildings
+from metrics import edges_similarity, edges_jaccard, approx_ged
 
 import csv
 import json
 import pickle
 import random
 from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 
 client = OpenAI()
 
     
+@profiled('dispatch')
 def prompt_chatgpt(instructions: dict, num_shots, model: str = CHATGPT_API.MODEL,
         seed: int =CHATGPT_API.SEED, save_path: str = ''):
     """
@@ -64,8 +70,172 @@ def prompt_chatgpt(instructions: dict, num_shots, model: str = CHATGPT_API.MODEL
     return completion
 
 
+def prepare_shots(shots_buildings, regions_connectivity, encoding=PROMPTER.ENCODING):
+    """
+    Builds the few-shot examples from the first instructions sequence of each
+    building, answered with its ground-truth connectivity graph.
+
+    Args:
+        shots_buildings (list(str)): Buildings used as shots.
+        regions_connectivity (dict): Ground-truth connectivity graphs.
+        encoding (str, optional): Prompt encoding. Defaults to PROMPTER.ENCODING.
+
+    Returns:
+        list(dict): [{'user': str, 'assistant': str}, ...].
+    """
+    shots = []
+    for building in shots_buildings:
+        system, user = generate_prompt(building, 0, encoding=encoding)
+        assistant = json.dumps({'connectivity_graph': regions_connectivity[building]})
+        shots.append({'user': user, 'assistant': assistant})
+
+    return shots
+
+
+def prepare_level_shots(shots_buildings, regions_connectivity, encoding=PROMPTER.ENCODING):
+    """
+    Builds the few-shot examples of the decomposed mode, from the first
+    instructions sequence of each building: one for its level 0, answered with
+    the ground truth between regions of that level, and one for the
+    connections between its levels.
+
+    Returns:
+        dict: {'level': [{'user': str, 'assistant': str}, ...],
+            'inter_level': [{'user': str, 'assistant': str}, ...]}.
+    """
+    shots = {'level': [], 'inter_level': []}
+    for building in shots_buildings:
+        levels = regions_levels(building)
+        level_graph, inter_level_graph = {}, {}
+        for region, connected in regions_connectivity[building].items():
+            if region not in levels:
+                continue
+            for connected_region in connected:
+                if levels.get(connected_region) == levels[region]:
+                    if levels[region] == '0':
+                        level_graph.setdefault(region, []).append(connected_region)
+                elif connected_region in levels:
+                    inter_level_graph.setdefault(region, []).append(connected_region)
+
+        system, user = generate_level_prompt(building, 0, '0', encoding=encoding)
+        assistant = json.dumps({'connectivity_graph': level_graph})
+        shots['level'].append({'user': user, 'assistant': assistant})
+
+        system, user = generate_inter_level_prompt(building, 0, encoding=encoding)
+        assistant = json.dumps({'connectivity_graph': inter_level_graph})
+        shots['inter_level'].append({'user': user, 'assistant': assistant})
+
+    return shots
+
+
+def merge_connectivity_graphs(graphs):
+    """
+    Returns:
+        dict: Union of the connectivity graphs, {region (str): [int]}.
+    """
+    merged = {}
+    for graph in graphs:
+        for region, connected in graph.items():
+            merged.setdefault(str(region), set()).update(int(r) for r in connected)
+
+    return {region: sorted(connected) for region, connected in merged.items()}
+
+
+def prompt_chatgpt_by_level(building, instruction_index, shots, num_shots,
+    model: str = CHATGPT_API.MODEL, seed: int = CHATGPT_API.SEED,
+    encoding=PROMPTER.ENCODING):
+    """
+    Prompts every level of a building, and the connections between its levels,
+    concurrently, and merges the returned graphs into one connectivity graph.
+    Levels without instructions in the sequence are not prompted. Completions
+    that cannot be parsed are listed in 'failed', and the merged graph is then
+    incomplete.
+
+    Args:
+        building (str): Building to prompt.
+        instruction_index (int): Index of the instructions sequence.
+        shots (dict): Shots returned by prepare_level_shots.
+        num_shots (int): Number of training shots.
+        model (str, optional): ChatGPT model to prompt. Defaults to CHATGPT_API.MODEL.
+        seed (int, optional): Model seed. Defaults to CHATGPT_API.SEED.
+        encoding (str, optional): Prompt encoding. Defaults to PROMPTER.ENCODING.
+
+    Returns:
+        dict: {
+            'connectivity_graph': {region (str): [int]},
+            'completions': {level_index (str) | 'inter_level': completion},
+            'failed': [level_index (str) | 'inter_level']
+        }.
+    """
+    level_instructions, inter_level_instructions = split_instructions_by_level(
+        building, text2map_navigation_instructions[building][instruction_index]
+    )
+
+    prompts = {}
+    for level in level_instructions:
+        system, user = generate_level_prompt(building, instruction_index, level, encoding=encoding)
+        prompts[level] = {'system': system, 'shots': shots['level'], 'prompt': user}
+    if inter_level_instructions:
+        system, user = generate_inter_level_prompt(building, instruction_index, encoding=encoding)
+        prompts['inter_level'] = {'system': system, 'shots': shots['inter_level'], 'prompt': user}
+
+    with ThreadPoolExecutor(max(1, len(prompts))) as executor:
+        futures = {
+            key: executor.submit(prompt_chatgpt, prompt, num_shots, model, seed)
+            for key, prompt in prompts.items()
+        }
+        completions = {key: future.result() for key, future in futures.items()}
+
+    graphs = []
+    failed = []
+    for key, completion in completions.items():
+        try:
+            graphs.append(parse_completion(completion))
+        except Exception as e:
+            print(f'{building} {key}: {e}')
+            failed.append(key)
+
+    return {
+        'connectivity_graph': merge_connectivity_graphs(graphs),
+        'completions': completions,
+        'failed': failed
+    }
+
+
+def consensus_reached(graphs, tolerance=ADAPTIVE.TOLERANCE, min_samples=ADAPTIVE.MIN_SAMPLES,
+    window=ADAPTIVE.WINDOW):
+    """
+    Checks whether the graphs predicted so far for a building have stabilized:
+    at least min_samples predictions, and each of the last window pairs of
+    successive predictions has a Jaccard similarity of its edges within
+    tolerance of 1. Absent edges do not count as agreeing, unlike in
+    edges_similarity, which is close to 1 for any two sparse graphs.
+
+    The defaults stop after two agreeing predictions, so that buildings with 3
+    sequences can save a request. Two predictions can agree and both be wrong,
+    a larger window and min_samples trade requests for confidence.
+
+    Args:
+        graphs (list(dict)): Parsed predictions, in order of arrival.
+        tolerance (float, optional): Defaults to ADAPTIVE.TOLERANCE.
+        min_samples (int, optional): Defaults to ADAPTIVE.MIN_SAMPLES.
+        window (int, optional): Defaults to ADAPTIVE.WINDOW.
+
+    Returns:
+        bool: True if no more sequences need to be prompted.
+    """
+    if len(graphs) < max(window + 1, min_samples):
+        return False
+    return all(
+        1 - edges_jaccard(graphs[k - 1], graphs[k]) <= tolerance
+        for k in range(len(graphs) - window, len(graphs))
+    )
+
+
 def test_pipeline(text2map_instructions_path, regions_connectivity_path, 
-    num_shots, save_path=''):
+    num_shots, save_path='', encoding=PROMPTER.ENCODING, decompose_levels=False,
+    adaptive=False, tolerance=ADAPTIVE.TOLERANCE, min_samples=ADAPTIVE.MIN_SAMPLES,
+    window=ADAPTIVE.WINDOW, adaptive_report_path='', shots_strategy=SHOTS.STRATEGY):
     """
     Prompts all instructions to chatgpt and gets reults. The first num_shots 
     building are used for few-shot learning. 
@@ -76,6 +246,19 @@ def test_pipeline(text2map_instructions_path, regions_connectivity_path,
         regions_connectivity_path (str): Path to the ground-truth connectivity.
         num_shots (int): Number of shots in few-shots learning.
         save_path (str, optional): .pkl file to save returned objects. Defaults to ''.
+        encoding (str, optional): Prompt encoding. Defaults to PROMPTER.ENCODING.
+        decompose_levels (bool, optional): Prompt multi-level buildings level by
+            level with prompt_chatgpt_by_level. Defaults to False.
+        adaptive (bool, optional): Stop prompting the sequences of a building
+            once consensus_reached. Defaults to False.
+        tolerance (float, optional): See consensus_reached. Defaults to ADAPTIVE.TOLERANCE.
+        min_samples (int, optional): See consensus_reached. Defaults to ADAPTIVE.MIN_SAMPLES.
+        window (int, optional): See consensus_reached. Defaults to ADAPTIVE.WINDOW.
+        adaptive_report_path (str.csv, optional): Path to save the requests
+            saved per building in adaptive mode. Defaults to ''.
+        shots_strategy (str, optional): 'random' samples the shots buildings,
+            'similar' picks the num_shots buildings nearest to the prompted one
+            by metadata features in the shots index. Defaults to SHOTS.STRATEGY.
 
     Returns:
         list(completion): List of completions returned by chatgpt.
@@ -87,29 +270,64 @@ def test_pipeline(text2map_instructions_path, regions_connectivity_path,
         regions_connectivity = pickle.load(file)
 
     buildings = list(text2map_instructions.keys())
+    if adaptive:
+        max_sequences = max(len(sequences) for sequences in text2map_instructions.values())
+        if max(window + 1, min_samples) >= max_sequences:
+            print(f'Warning: adaptive mode needs {max(window + 1, min_samples)} predictions to '
+                f'stop, buildings have at most {max_sequences} sequences, no request will be saved')
+    if shots_strategy == 'similar':
+        shots_index = load_shots_index(regions_connectivity_path)
+    elif shots_strategy != 'random':
+        raise ValueError(f'Unknown shots strategy: {shots_strategy}')
 
     # Loops through the building and prompt GPT
     results = {}
+    saved_requests = []
 
     for i in tqdm(range(0, len(text2map_instructions))):
         print('Building:', buildings[i])
+        set_building_size(len(regions_connectivity[buildings[i]]))
 
         # Prepare the shots
-        shots_buildings = random.sample(buildings, num_shots)
-        shots = []
-        for building in shots_buildings:
-            system, user = generate_prompt(building, 0)
-            assistant = json.dumps({'connectivity_graph': regions_connectivity[building]})
-            shots.append({'user': user, 'assistant': assistant})
+        if shots_strategy == 'similar':
+            shots_buildings = similar_buildings(shots_index, buildings[i], num_shots)
+        else:
+            shots_buildings = random.sample(buildings, num_shots)
+        shots = prepare_shots(shots_buildings, regions_connectivity, encoding)
+        decompose = decompose_levels and len(set(regions_levels(buildings[i]).values())) > 1
+        if decompose:
+            level_shots = prepare_level_shots(shots_buildings, regions_connectivity, encoding)
 
         # Build prompt
         results[buildings[i]] = []
+        graphs = []
         for j in range(len(text2map_instructions[buildings[i]])):
-            system, user = generate_prompt(buildings[i], j)
-            prompt = {'system': system, 'shots': shots, 'prompt': user}
-            chatgpt_result = prompt_chatgpt(prompt, num_shots)
+            if decompose:
+                chatgpt_result = prompt_chatgpt_by_level(
+                    buildings[i], j, level_shots, num_shots, encoding=encoding
+                )
+            else:
+                system, user = generate_prompt(buildings[i], j, encoding=encoding)
+                prompt = {'system': system, 'shots': shots, 'prompt': user}
+                chatgpt_result = prompt_chatgpt(prompt, num_shots)
             results[buildings[i]].append(chatgpt_result)
 
+            # Stop once the predictions agree
+            if adaptive:
+                try:
+                    graphs.append(parse_completion(chatgpt_result))
+                except Exception as e:
+                    print(e)
+                    continue
+                if consensus_reached(graphs, tolerance, min_samples, window):
+                    break
+
+        if adaptive:
+            num_sequences = len(text2map_instructions[buildings[i]])
+            num_requests = len(results[buildings[i]])
+            saved_requests.append([buildings[i], num_sequences, num_requests, num_sequences - num_requests])
+            print(f'{buildings[i]}: saved {num_sequences - num_requests} of {num_sequences} requests')
+
         # Save Result
         if save_path:
             with open(save_path, 'wb') as pickle_file:
@@ -122,9 +340,35 @@ def test_pipeline(text2map_instructions_path, regions_connectivity_path,
         with open(save_path, 'wb') as pickle_file:
             pickle.dump(results, pickle_file)
 
+    if adaptive:
+        print(f'Saved {sum(row[3] for row in saved_requests)} of '
+            f'{sum(row[1] for row in saved_requests)} requests')
+    if adaptive and adaptive_report_path:
+        with open(adaptive_report_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Building ID", "Number of Sequences", "Requests", "Saved Requests"])
+            writer.writerows(saved_requests)
+
     return results
 
 
+@profiled('parse')
+def parse_completion(completion):
+    """
+    Returns:
+        dict: Connectivity graph returned in a chatgpt completion, or merged
+        by prompt_chatgpt_by_level.
+
+    Raises:
+        ValueError: If some levels of a merged graph failed.
+    """
+    if isinstance(completion, dict):
+        if completion.get('failed'):
+            raise ValueError(f"Failed levels: {completion['failed']}")
+        return completion['connectivity_graph']
+    return json.loads(completion.choices[0].message.content)['connectivity_graph']
+
+
 def compare_results(chatgpt_results_path, regions_connectivity_path, save_path=''):
     # Open file to load chatgpt results and ground-truth connectivity graphs
     with open(chatgpt_results_path, 'rb') as file:
@@ -136,14 +380,15 @@ def compare_results(chatgpt_results_path, regions_connectivity_path, save_path='
     sims = []
     for building in chatgpt_results:
         ground_truth = regions_connectivity[building]
+        set_building_size(len(ground_truth))
     
         min_dist = 1000
         max_sim = 0
         for result in chatgpt_results[building]:
             try:
-                chatgpt_result = json.loads(result.choices[0].message.content)
-                graph_dist = approx_ged(ground_truth, chatgpt_result['connectivity_graph'])
-                _, graph_sim = edges_similarity(ground_truth, chatgpt_result['connectivity_graph'])
+                connectivity_graph = parse_completion(result)
+                graph_dist = approx_ged(ground_truth, connectivity_graph)
+                _, graph_sim = edges_similarity(ground_truth, connectivity_graph)
                 if graph_dist < min_dist:
                     min_dist = graph_dist
                 if graph_sim > max_sim:
@@ -1,3 +1,8 @@
+import sys
+sys.path.append('../')
+
+from profiling import profiled
+
 import networkx as nx
 import gmatch4py as gm
 
@@ -15,6 +20,7 @@ def dictGraph_to_networkXGraph(graph_dict):
     return G
 
 
+@profiled('maximum_common_subgraph')
 def maximum_common_subgraph(G1_dict, G2_dict):
     # Convert the dict representations to NetworkX graphs
     G1 = dictGraph_to_networkXGraph(G1_dict)
@@ -39,6 +45,7 @@ def maximum_common_subgraph(G1_dict, G2_dict):
     return (mcs.number_of_nodes() + mcs.number_of_edges()) / domain
 
 
+@profiled('edges_similarity')
 def edges_similarity(G1_dict, G2_dict):
     # Convert the dict representations to NetworkX graphs
     G1 = dictGraph_to_networkXGraph(G1_dict)
@@ -62,6 +69,21 @@ def edges_similarity(G1_dict, G2_dict):
     return node_percentage, edge_percentage
 
 
+@profiled('edges_jaccard')
+def edges_jaccard(G1_dict, G2_dict):
+    # Convert the dict representations to NetworkX graphs
+    G1 = dictGraph_to_networkXGraph(G1_dict)
+    G2 = dictGraph_to_networkXGraph(G2_dict)
+
+    # Compare the edges of the two graphs only, without self loops
+    edges_G1 = {frozenset(edge) for edge in G1.edges() if edge[0] != edge[1]}
+    edges_G2 = {frozenset(edge) for edge in G2.edges() if edge[0] != edge[1]}
+    all_edges = edges_G1 | edges_G2
+
+    return len(edges_G1 & edges_G2) / len(all_edges) if all_edges else 1
+
+
+@profiled('approx_ged')
 def approx_ged(G1_dict, G2_dict):
     # Convert the dict representations to NetworkX graphs
     G1 = dictGraph_to_networkXGraph(G1_dict)
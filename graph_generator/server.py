@@ -0,0 +1,192 @@
+import sys
+sys.path.append('../')
+
+from config import PROMPTER, SERVER
+from prompting_engine.prompter import generate_prompt, PROMPT_ENCODINGS
+from metrics import edges_similarity, approx_ged, maximum_common_subgraph
+
+import json
+import pickle
+import functools
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+"""
+Local HTTP service keeping the dataset, the ground-truth graphs and the
+rendered prompts in memory. Scoring runs in a pool of worker processes.
+
+GET  /prompt?building=<id>&sequence=<int>[&encoding=<str>][&chatgpt_format=0]
+POST /score         {"building": str, "connectivity_graph": dict}
+POST /score/batch   {"items": [{"building": str, "connectivity_graph": dict}, ...]}
+"""
+# ------------------------------------------------------------------------------
+regions_connectivity = {}
+executor = None
+score_cache = OrderedDict()
+score_cache_lock = threading.Lock()
+# ------------------------------------------------------------------------------
+
+
+def load_ground_truth(regions_connectivity_path):
+    global regions_connectivity
+    with open(regions_connectivity_path, 'rb') as file:
+        regions_connectivity = pickle.load(file)
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_prompt(building_id, instruction_index, chatgpt_format, encoding):
+    return generate_prompt(building_id, instruction_index, chatgpt_format, encoding)
+
+
+def score_graph(building_id, connectivity_graph_json):
+    """
+    Scores a connectivity graph against the ground truth of the building with
+    all the metrics. Runs in the worker processes.
+
+    Returns:
+        dict: {'building', 'num_regions', 'approx_ged', 'nodes_similarity',
+            'edges_similarity', 'maximum_common_subgraph'}, and 'errors' for
+            the metrics that failed.
+    """
+    ground_truth = regions_connectivity[building_id]
+    connectivity_graph = json.loads(connectivity_graph_json)
+
+    result = {'building': building_id, 'num_regions': len(ground_truth)}
+    errors = {}
+    try:
+        result['approx_ged'] = approx_ged(ground_truth, connectivity_graph)
+    except Exception as e:
+        errors['approx_ged'] = repr(e)
+    try:
+        result['nodes_similarity'], result['edges_similarity'] = edges_similarity(
+            ground_truth, connectivity_graph
+        )
+    except Exception as e:
+        errors['edges_similarity'] = repr(e)
+    try:
+        result['maximum_common_subgraph'] = maximum_common_subgraph(ground_truth, connectivity_graph)
+    except Exception as e:
+        errors['maximum_common_subgraph'] = repr(e)
+
+    if errors:
+        result['errors'] = errors
+    return result
+
+
+def submit_scores(items):
+    """
+    Sends the items to the worker pool. Futures are cached in this process,
+    keyed on (building, graph json), so a repeated submission, even while the
+    first one is still running, does not reach the workers again.
+
+    Returns:
+        list(dict): Scores of the items, in order.
+    """
+    keys = []
+    for item in items:
+        if item['building'] not in regions_connectivity:
+            raise KeyError(f"Unknown building: {item['building']}")
+        keys.append((item['building'], json.dumps(item['connectivity_graph'], sort_keys=True)))
+
+    futures = []
+    with score_cache_lock:
+        for key in keys:
+            if key in score_cache:
+                score_cache.move_to_end(key)
+            else:
+                score_cache[key] = executor.submit(score_graph, *key)
+                if len(score_cache) > SERVER.SCORE_CACHE_SIZE:
+                    score_cache.popitem(last=False)
+            futures.append(score_cache[key])
+
+    results = []
+    for key, future in zip(keys, futures):
+        try:
+            results.append(future.result())
+        except Exception:
+            with score_cache_lock:
+                if score_cache.get(key) is future:
+                    del score_cache[key]
+            raise
+
+    return results
+
+
+class Text2mapHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/prompt':
+            return self.send_json(404, {'error': f'Unknown path: {url.path}'})
+
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            encoding = query.get('encoding', PROMPTER.ENCODING)
+            if encoding not in PROMPT_ENCODINGS:
+                raise ValueError(f'Unknown prompt encoding: {encoding}')
+            chatgpt_format = query.get('chatgpt_format', '1') != '0'
+            prompt = cached_prompt(query['building'], int(query['sequence']), chatgpt_format, encoding)
+        except (KeyError, IndexError, ValueError) as e:
+            return self.send_json(400, {'error': repr(e)})
+
+        if chatgpt_format:
+            return self.send_json(200, {'system': prompt[0], 'user': prompt[1]})
+        return self.send_json(200, {'prompt': prompt})
+
+    def do_POST(self):
+        try:
+            body = self.read_json()
+            if self.path == '/score':
+                return self.send_json(200, submit_scores([body])[0])
+            if self.path == '/score/batch':
+                return self.send_json(200, {'results': submit_scores(body['items'])})
+        except (KeyError, TypeError, ValueError) as e:
+            return self.send_json(400, {'error': repr(e)})
+
+        return self.send_json(404, {'error': f'Unknown path: {self.path}'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(regions_connectivity_path, host=SERVER.HOST, port=SERVER.PORT,
+    workers=SERVER.WORKERS):
+    """
+    Starts the service and blocks until interrupted.
+
+    Args:
+        regions_connectivity_path (str): Path to the ground-truth connectivity.
+        host (str, optional): Defaults to SERVER.HOST.
+        port (int, optional): Defaults to SERVER.PORT.
+        workers (int, optional): Scoring processes. Defaults to SERVER.WORKERS.
+    """
+    global executor
+    load_ground_truth(regions_connectivity_path)
+    executor = ProcessPoolExecutor(
+        workers, initializer=load_ground_truth, initargs=(regions_connectivity_path,)
+    )
+
+    server = ThreadingHTTPServer((host, port), Text2mapHandler)
+    print(f'Serving on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown()
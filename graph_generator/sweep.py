@@ -0,0 +1,340 @@
+import sys
+sys.path.append('../')
+
+from config import CHATGPT_API, PROMPTER, SWEEP
+from profiling import set_building_size
+from chatgpt_api import prompt_chatgpt, prepare_shots
+from prompting_engine.prompter import generate_prompt
+
+import os
+import json
+import time
+import uuid
+import pickle
+import random
+import sqlite3
+import itertools
+import multiprocessing
+
+
+"""
+Lease-based work queue for experiment grids. A sweep is expanded into work
+units (model, num_shots, seed, encoding, building, sequence) stored in a SQLite
+file, so any number of worker processes can pull units without duplicating
+work. A unit leased by a worker that died is handed out again once its lease
+expires, until it runs out of attempts.
+
+The database uses WAL, which needs all the workers on the same host. To share
+the file over a network filesystem, set SWEEP.WAL = False to use the rollback
+journal, which is only as safe as the file locking of that filesystem.
+"""
+# ------------------------------------------------------------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    num_shots INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    encoding TEXT NOT NULL,
+    building TEXT NOT NULL,
+    sequence INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (model, num_shots, seed, encoding, building, sequence)
+);
+CREATE TABLE IF NOT EXISTS results (
+    unit_id INTEGER PRIMARY KEY REFERENCES units(id),
+    worker TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    completion BLOB NOT NULL
+);
+"""
+# ------------------------------------------------------------------------------
+
+
+def connect(db_path=SWEEP.DB_PATH, wal=SWEEP.WAL):
+    """
+    Opens the sweep database and creates its tables if needed.
+
+    Args:
+        db_path (str.db, optional): Path to the SQLite file. Defaults to SWEEP.DB_PATH.
+        wal (bool, optional): Use WAL, otherwise the rollback journal, for
+            files on shared storage. Defaults to SWEEP.WAL.
+
+    Returns:
+        sqlite3.Connection: Connection in autocommit mode.
+    """
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    connection.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def expand_sweep(sweep_spec, text2map_instructions_path):
+    """
+    Expands a sweep specification into work units, one per instructions sequence.
+
+    Args:
+        sweep_spec (dict): {
+                'models': [str] (Defaults to [CHATGPT_API.MODEL]),
+                'num_shots': [int],
+                'seeds': [int] (Defaults to [CHATGPT_API.SEED]),
+                'encodings': [str] (Defaults to [PROMPTER.ENCODING]),
+                'buildings': [str] (Optional, defaults to all buildings)
+            }.
+        text2map_instructions_path (str.json): Path to the generated instructions.
+
+    Returns:
+        list(tuple): [(model, num_shots, seed, encoding, building, sequence), ...].
+    """
+    with open(text2map_instructions_path, 'r') as file:
+        text2map_instructions = json.load(file)
+
+    buildings = sweep_spec.get('buildings') or list(text2map_instructions.keys())
+    models = sweep_spec.get('models', [CHATGPT_API.MODEL])
+    seeds = sweep_spec.get('seeds', [CHATGPT_API.SEED])
+    encodings = sweep_spec.get('encodings', [PROMPTER.ENCODING])
+
+    units = []
+    for model, num_shots, seed, encoding in itertools.product(
+            models, sweep_spec['num_shots'], seeds, encodings):
+        for building in buildings:
+            for sequence in range(len(text2map_instructions[building])):
+                units.append((model, num_shots, seed, encoding, building, sequence))
+
+    return units
+
+
+def enqueue_sweep(sweep_spec, text2map_instructions_path, db_path=SWEEP.DB_PATH):
+    """
+    Adds the units of a sweep to the queue. Units already in the queue are
+    kept as they are, so the same sweep can be enqueued again safely.
+
+    Returns:
+        int: Number of newly added units.
+    """
+    units = expand_sweep(sweep_spec, text2map_instructions_path)
+
+    connection = connect(db_path)
+    connection.execute('BEGIN IMMEDIATE')
+    before = connection.execute('SELECT COUNT(*) FROM units').fetchone()[0]
+    connection.executemany(
+        'INSERT OR IGNORE INTO units (model, num_shots, seed, encoding, building, sequence) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        units
+    )
+    after = connection.execute('SELECT COUNT(*) FROM units').fetchone()[0]
+    connection.execute('COMMIT')
+    connection.close()
+
+    return after - before
+
+
+def claim_unit(connection, worker, lease_seconds=SWEEP.LEASE_SECONDS,
+    max_attempts=SWEEP.MAX_ATTEMPTS):
+    """
+    Leases the next pending unit, or a unit whose lease has expired. Units
+    whose lease expired on their last attempt are marked failed.
+
+    Returns:
+        tuple: (unit_id, model, num_shots, seed, encoding, building, sequence), or None
+        when there is nothing left to do.
+    """
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute(
+        "UPDATE units SET status = 'failed', lease_expires = NULL, "
+        "error = 'lease timeout' "
+        "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+        (now, max_attempts)
+    )
+    row = connection.execute(
+        "SELECT id, model, num_shots, seed, encoding, building, sequence FROM units "
+        "WHERE attempts < ? AND (status = 'pending' "
+        "OR (status = 'leased' AND lease_expires < ?)) "
+        "ORDER BY id LIMIT 1",
+        (max_attempts, now)
+    ).fetchone()
+    if row is not None:
+        connection.execute(
+            "UPDATE units SET status = 'leased', lease_owner = ?, "
+            "lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+            (worker, now + lease_seconds, row[0])
+        )
+    connection.execute('COMMIT')
+
+    return row
+
+
+def next_lease_expiry(connection):
+    """
+    Returns:
+        float: Earliest lease expiry of the leased units, or None if no unit is leased.
+    """
+    return connection.execute(
+        "SELECT MIN(lease_expires) FROM units WHERE status = 'leased'"
+    ).fetchone()[0]
+
+
+def complete_unit(connection, worker, unit_id, completion):
+    """
+    Stores the completion of a unit. The result is dropped if the lease was
+    lost to another worker in the meantime.
+
+    Returns:
+        bool: True if the result was stored.
+    """
+    connection.execute('BEGIN IMMEDIATE')
+    updated = connection.execute(
+        "UPDATE units SET status = 'done', lease_expires = NULL, error = NULL "
+        "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+        (unit_id, worker)
+    ).rowcount
+    if updated:
+        connection.execute(
+            'INSERT OR REPLACE INTO results (unit_id, worker, finished_at, completion) '
+            'VALUES (?, ?, ?, ?)',
+            (unit_id, worker, time.time(), pickle.dumps(completion))
+        )
+    connection.execute('COMMIT')
+
+    return bool(updated)
+
+
+def fail_unit(connection, worker, unit_id, error, max_attempts=SWEEP.MAX_ATTEMPTS):
+    """
+    Releases a unit after an error, so it can be retried until max_attempts.
+    """
+    connection.execute(
+        "UPDATE units SET status = CASE WHEN attempts >= ? THEN 'failed' "
+        "ELSE 'pending' END, lease_expires = NULL, error = ? "
+        "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+        (max_attempts, error, unit_id, worker)
+    )
+
+
+def sweep_worker(text2map_instructions_path, regions_connectivity_path,
+    db_path=SWEEP.DB_PATH, lease_seconds=SWEEP.LEASE_SECONDS,
+    max_attempts=SWEEP.MAX_ATTEMPTS, poll_seconds=SWEEP.POLL_SECONDS,
+    prompt_fn=prompt_chatgpt):
+    """
+    Pulls units from the queue and prompts chatgpt until the queue is drained.
+    While other units are still leased, it waits for them to be completed or
+    for their lease to expire, so the units of dead workers are recovered.
+    Few-shot buildings are sampled with a generator seeded by the unit, so every
+    sequence of a building sees the same shots, whichever worker runs it.
+
+    Args:
+        text2map_instructions_path (str.json): Path to the generated instructions.
+        regions_connectivity_path (str): Path to the ground-truth connectivity.
+        db_path (str.db, optional): Path to the sweep database. Defaults to SWEEP.DB_PATH.
+        lease_seconds (int, optional): Lease duration. Defaults to SWEEP.LEASE_SECONDS.
+        max_attempts (int, optional): Attempts per unit. Defaults to SWEEP.MAX_ATTEMPTS.
+        poll_seconds (float, optional): Longest wait between two claims while
+            units are leased. Defaults to SWEEP.POLL_SECONDS.
+        prompt_fn (callable, optional): Function called as
+            prompt_fn(instructions, num_shots, model=, seed=). Defaults to prompt_chatgpt.
+
+    Returns:
+        int: Number of units completed by this worker.
+    """
+    with open(text2map_instructions_path, 'r') as file:
+        text2map_instructions = json.load(file)
+    with open(regions_connectivity_path, 'rb') as file:
+        regions_connectivity = pickle.load(file)
+    buildings = list(text2map_instructions.keys())
+
+    worker = f'{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    connection = connect(db_path)
+
+    completed = 0
+    while True:
+        unit = claim_unit(connection, worker, lease_seconds, max_attempts)
+        if unit is None:
+            lease_expires = next_lease_expiry(connection)
+            if lease_expires is None:
+                break
+            time.sleep(min(poll_seconds, max(0, lease_expires - time.time()) + 0.1))
+            continue
+        unit_id, model, num_shots, seed, encoding, building, sequence = unit
+
+        set_building_size(len(regions_connectivity[building]))
+        try:
+            rng = random.Random(f'{seed}:{num_shots}:{building}')
+            shots = prepare_shots(rng.sample(buildings, num_shots), regions_connectivity, encoding)
+            system, user = generate_prompt(building, sequence, encoding=encoding)
+            prompt = {'system': system, 'shots': shots, 'prompt': user}
+            completion = prompt_fn(prompt, num_shots, model=model, seed=seed)
+        except Exception as e:
+            print(f'Unit {unit_id} failed: {e}')
+            fail_unit(connection, worker, unit_id, repr(e), max_attempts)
+            continue
+
+        if complete_unit(connection, worker, unit_id, completion):
+            completed += 1
+
+    connection.close()
+    return completed
+
+
+def run_local_workers(text2map_instructions_path, regions_connectivity_path,
+    num_workers, db_path=SWEEP.DB_PATH, **worker_kwargs):
+    """
+    Runs num_workers worker processes on this machine against the same queue.
+
+    Returns:
+        int: Number of units completed by all workers.
+    """
+    args = (text2map_instructions_path, regions_connectivity_path, db_path)
+    with multiprocessing.Pool(num_workers) as pool:
+        results = [
+            pool.apply_async(sweep_worker, args, worker_kwargs)
+            for _ in range(num_workers)
+        ]
+        return sum(result.get() for result in results)
+
+
+def sweep_status(db_path=SWEEP.DB_PATH):
+    """
+    Returns:
+        dict: {status (str): number of units}.
+    """
+    connection = connect(db_path)
+    rows = connection.execute('SELECT status, COUNT(*) FROM units GROUP BY status').fetchall()
+    connection.close()
+    return dict(rows)
+
+
+def collect_results(model, num_shots, seed, encoding=PROMPTER.ENCODING,
+    db_path=SWEEP.DB_PATH, save_path=''):
+    """
+    Gathers the completions of one (model, num_shots, seed, encoding) run, in the format
+    returned by test_pipeline, so they can be passed to compare_results.
+
+    Returns:
+        dict: {building_id (str): [completion, ...]} ordered by sequence.
+    """
+    connection = connect(db_path)
+    rows = connection.execute(
+        'SELECT u.building, r.completion FROM units u JOIN results r ON r.unit_id = u.id '
+        'WHERE u.model = ? AND u.num_shots = ? AND u.seed = ? AND u.encoding = ? '
+        'ORDER BY u.building, u.sequence',
+        (model, num_shots, seed, encoding)
+    ).fetchall()
+    connection.close()
+
+    results = {}
+    for building, completion in rows:
+        results.setdefault(building, []).append(pickle.loads(completion))
+
+    # Save Result
+    if save_path:
+        with open(save_path, 'wb') as pickle_file:
+            pickle.dump(results, pickle_file)
+
+    return results
@@ -0,0 +1,140 @@
+from config import PROFILING
+
+import math
+import time
+import atexit
+import cProfile
+import functools
+import threading
+import tracemalloc
+from collections import defaultdict
+
+
+"""
+Opt-in timers for the pipeline stages (prompt, dispatch, parse, metrics).
+Enabled with TEXT2MAP_PROFILE=1, otherwise profiled returns the functions
+untouched. Timings and allocation peaks are grouped by building size, set with
+set_building_size, and the report is written at exit to PROFILING.REPORT_PATH.
+"""
+# ------------------------------------------------------------------------------
+timings = defaultdict(list)
+memory_peaks = defaultdict(int)
+current_size = None
+profiler = None
+state = threading.local()
+lock = threading.Lock()
+# ------------------------------------------------------------------------------
+
+
+def set_building_size(num_regions):
+    """
+    Sets the number of regions of the building being processed, used to group
+    the measures of the following stages.
+    """
+    global current_size
+    current_size = num_regions
+
+
+def size_bucket():
+    if current_size is None:
+        return '-'
+    start = current_size // PROFILING.SIZE_BUCKET * PROFILING.SIZE_BUCKET
+    return f'{start}-{start + PROFILING.SIZE_BUCKET - 1}'
+
+
+def profiled(stage):
+    """
+    Decorator timing every call of a function as stage. With
+    TEXT2MAP_PROFILE_MEMORY=1 it also records the allocation peak of the call,
+    and with TEXT2MAP_PROFILE_CPROFILE=<path> it runs the call under cProfile.
+    """
+    def decorator(func):
+        if not PROFILING.ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Nested stages are timed, but only the outermost one resets the
+            # allocation peak and toggles cProfile
+            state.depth = getattr(state, 'depth', 0) + 1
+            outermost = state.depth == 1
+            if outermost and profiler is not None:
+                profiler.enable()
+            if PROFILING.MEMORY:
+                if outermost:
+                    tracemalloc.reset_peak()
+                memory_start = tracemalloc.get_traced_memory()[0]
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with lock:
+                    key = (stage, size_bucket())
+                    timings[key].append(elapsed)
+                    if PROFILING.MEMORY:
+                        peak = tracemalloc.get_traced_memory()[1] - memory_start
+                        memory_peaks[key] = max(memory_peaks[key], peak)
+                if outermost and profiler is not None:
+                    profiler.disable()
+                state.depth -= 1
+
+        return wrapper
+    return decorator
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def histogram(values):
+    """
+    Counts the values in power of two buckets of milliseconds.
+    """
+    counts = defaultdict(int)
+    for value in values:
+        counts[max(0, math.ceil(math.log2(max(value * 1000, 1e-3))))] += 1
+    return ' '.join(f'<={2 ** exponent}ms:{counts[exponent]}' for exponent in sorted(counts))
+
+
+def report():
+    """
+    Returns:
+        str: Count, total, mean, p50, p95 and max time, histogram and
+        allocation peak of every (stage, building size) pair.
+    """
+    lines = [f"{'stage':<24} {'size':<8} {'count':>6} {'total_s':>9} {'mean_ms':>9} "
+        f"{'p50_ms':>9} {'p95_ms':>9} {'max_ms':>9} {'peak_kb':>9}  histogram"]
+    with lock:
+        for (stage, bucket), values in sorted(timings.items()):
+            values = sorted(values)
+            peak = f'{memory_peaks[(stage, bucket)] / 1024:.1f}' if PROFILING.MEMORY else '-'
+            lines.append(
+                f'{stage:<24} {bucket:<8} {len(values):>6} {sum(values):>9.3f} '
+                f'{1000 * sum(values) / len(values):>9.2f} {1000 * percentile(values, 0.5):>9.2f} '
+                f'{1000 * percentile(values, 0.95):>9.2f} {1000 * values[-1]:>9.2f} {peak:>9}  '
+                f'{histogram(values)}'
+            )
+
+    return '\n'.join(lines) + '\n'
+
+
+def dump_report(save_path=PROFILING.REPORT_PATH):
+    """
+    Writes the report, and the cProfile stats if enabled.
+    """
+    if not timings:
+        return
+    with open(save_path, 'w') as file:
+        file.write(report())
+    if profiler is not None:
+        profiler.dump_stats(PROFILING.CPROFILE_PATH)
+
+
+if PROFILING.ENABLED:
+    if PROFILING.MEMORY:
+        tracemalloc.start()
+    if PROFILING.CPROFILE_PATH:
+        profiler = cProfile.Profile()
+    atexit.register(dump_report)
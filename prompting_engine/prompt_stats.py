@@ -0,0 +1,75 @@
+import sys
+sys.path.append('../')
+
+from config import CHATGPT_API
+from prompter import (generate_prompt, estimate_tokens, text2map_navigation_instructions,
+    PROMPT_ENCODINGS)
+
+import csv
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def count_tokens(text, model=CHATGPT_API.MODEL):
+    """
+    Counts the tokens of text with the tokenizer of the model. Falls back to
+    estimate_tokens when tiktoken is not installed.
+    """
+    if tiktoken is None:
+        return estimate_tokens(text)
+    try:
+        tokenizer = tiktoken.encoding_for_model(model)
+    except KeyError:
+        tokenizer = tiktoken.get_encoding('cl100k_base')
+    return len(tokenizer.encode(text))
+
+
+def encodings_token_counts(encodings=PROMPT_ENCODINGS, model=CHATGPT_API.MODEL, save_path=''):
+    """
+    Counts the tokens of the prompts of every instructions sequence in the
+    dataset, for each prompt encoding. Both the (system, user) messages sent to
+    chatgpt, and the full prompt with the regions information are counted.
+
+    Args:
+        encodings (list(str), optional): Encodings to compare. Defaults to PROMPT_ENCODINGS.
+        model (str, optional): Model whose tokenizer is used. Defaults to CHATGPT_API.MODEL.
+        save_path (str.csv, optional): Path to save the result. Defaults to ''.
+
+    Returns:
+        list: [[encoding, # requests, system tokens, user tokens, messages
+            tokens, full prompt tokens, % of verbose messages, % of verbose
+            full prompt], ...].
+    """
+    rows = []
+    for encoding in encodings:
+        requests = system_tokens = user_tokens = full_prompt_tokens = 0
+        for building, sequences in text2map_navigation_instructions.items():
+            for j in range(len(sequences)):
+                system, user = generate_prompt(building, j, encoding=encoding)
+                requests += 1
+                system_tokens += count_tokens(system, model)
+                user_tokens += count_tokens(user, model)
+                full_prompt_tokens += count_tokens(generate_prompt(building, j, False, encoding), model)
+
+        rows.append([encoding, requests, system_tokens, user_tokens,
+            system_tokens + user_tokens, full_prompt_tokens])
+
+    verbose_row = next((row for row in rows if row[0] == 'verbose'), None)
+    for row in rows:
+        row.append(100 * row[4] / verbose_row[4] if verbose_row else 0)
+        row.append(100 * row[5] / verbose_row[5] if verbose_row else 0)
+        print(f'{row[0]}: {row[4]} messages tokens, {row[5]} full prompt tokens')
+
+    # Save file as csv
+    if save_path:
+        with open(save_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Encoding", "# Requests", "System Tokens", "User Tokens",
+                "Messages Tokens", "Full Prompt Tokens", "% of Verbose Messages",
+                "% of Verbose Full Prompt"])
+            writer.writerows(rows)
+
+    return rows
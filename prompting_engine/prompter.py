@@ -1,3 +1,12 @@
+import sys
+sys.path.append('../')
+
+from config import PROMPTER
+from profiling import profiled
+
+import io
+import re
+import csv
 import json
 
 """
@@ -12,34 +21,29 @@ with open('../data/text2map_navigation_instructions.json', 'r') as file:
 
 with open('../data/regions_labels.json', 'r') as file:
     regions_lables = json.load(file)
+
+PROMPT_ENCODINGS = ('verbose', 'tabular', 'legend')
 # ------------------------------------------------------------------------------
 
 
-def generate_prompt(building_id, instruction_index, chatgpt_format=True):
-    introduction_str = (
-        "Act as a computer scientist cartographer and create a map "
-        "representation of an indoor building. I will provide you with 3 "
-        "things. First, the expected output format. Second, information about "
-        "the room-like regions of the building. We might have regions that "
-        "have the same name/label. Third, instructions for an agent to navigate "
-        "through the building. The navigation instructions are independent of "
-        "each other and they are not ordered. Also, please only focus on the "
-        "room-like regions of the building, and don't include any information "
-        "about the objects in it.\n\n"
-    )
+def estimate_tokens(text):
+    """
+    Approximates the number of tokens of text by its words and punctuation marks.
+    """
+    return len(re.findall(r"\w+|[^\w\s]", text))
 
-    introduction_str = "Create a connectivity Matrix from the following navigation instructions"
-    
-    output_format_str = (
-        "OUTPUT FORMAT: Return only a JSON object, I don't want any other "
-        "comments. The JSON contains one key named connectivity_graph which has "
-        "a value of a Python Dictionary. The dictionary contains a key for each "
-        "region index and the value for each key is a list of indices of regions "
-        "that are connected to it.\n\n"
-    )
-    
-    # Add Information about metadata of of the building
-    building_information = buildings_metadata[building_id]
+
+def csv_rows(rows):
+    """
+    Returns the rows as CSV lines, quoting fields only when needed.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def verbose_regions_information(building_information):
     number_of_levels = len(building_information)
     regions_information_str = (
         f"ROOM-LIKE REGIONS INFORMATION: This building contains {number_of_levels} "
@@ -47,7 +51,7 @@ def generate_prompt(building_id, instruction_index, chatgpt_format=True):
     )
     
     # Loop through levels and add their information
-    for i in range(number_of_levels):
+    for i in building_information:
         regions_information_str += (
             f"Level {i} contains {len(building_information[str(i)])} regions:\n"
         )
@@ -58,12 +62,38 @@ def generate_prompt(building_id, instruction_index, chatgpt_format=True):
             )
         regions_information_str += '\n'
 
-    # Add Navigation Instructions
-    building_navigation_instructions = text2map_navigation_instructions[building_id]
-    navigation_instructions = building_navigation_instructions[instruction_index]
-    
-    # navigation_instructions = navigation_instructions[:int(len(navigation_instructions) * 0.1)]
-    
+    return regions_information_str
+
+
+def tabular_regions_information(building_information):
+    """
+    Lists the regions as level,region,label rows.
+    """
+    rows = []
+    for level in building_information:
+        for region_idx, label in building_information[level]['regions'].items():
+            rows.append([level, region_idx, regions_lables[label]])
+
+    return "ROOM-LIKE REGIONS (level,region,label):\n" + csv_rows(rows) + "\n"
+
+
+def legend_regions_information(building_information):
+    """
+    Lists every label of a level once, followed by its regions, as
+    level,label,regions rows.
+    """
+    rows = []
+    for level in building_information:
+        label_regions = {}
+        for region_idx, label in building_information[level]['regions'].items():
+            label_regions.setdefault(regions_lables[label], []).append(region_idx)
+        for label, regions in label_regions.items():
+            rows.append([level, label, ' '.join(regions)])
+
+    return "ROOM-LIKE REGIONS (level,label,regions):\n" + csv_rows(rows) + "\n"
+
+
+def verbose_navigation_instructions(navigation_instructions):
     navigation_instructions_str = "NAVIGATION INSTRUCTIONS:\n"
     i = 1
     for instruction in navigation_instructions:
@@ -79,10 +109,228 @@ def generate_prompt(building_id, instruction_index, chatgpt_format=True):
         navigation_instructions_str += "\n"
         i +=1
 
+    return navigation_instructions_str
+
+
+def tabular_navigation_instructions(navigation_instructions):
+    rows = [
+        [instruction['start_region'], instruction['end_region'], instruction['instruction'][1]]
+        for instruction in navigation_instructions
+    ]
+    return (
+        "NAVIGATION INSTRUCTIONS (start region,end region,instruction):\n"
+        + csv_rows(rows)
+    )
+
+
+@profiled('prompt')
+def generate_prompt(building_id, instruction_index, chatgpt_format=True,
+    encoding=PROMPTER.ENCODING):
+    """
+    Generates the prompt of one instructions sequence of a building.
+
+    Args:
+        building_id (str): Building to describe.
+        instruction_index (int): Index of the instructions sequence.
+        chatgpt_format (bool, optional): Return (system, user) instead of a
+            single prompt. Defaults to True.
+        encoding (str, optional): One of PROMPT_ENCODINGS. Defaults to PROMPTER.ENCODING.
+            'verbose': Regions and instructions spelled out in sentences.
+            'tabular': Regions and instructions as CSV rows.
+            'legend': As tabular, with the regions grouped by label, so every
+                label of a level is written once. Regions are only part of
+                the prompt when not chatgpt_format, the (system, user)
+                messages are the same as tabular.
+
+    Returns:
+        (str, str) | str: (system, user) if chatgpt_format, otherwise the prompt.
+    """
+    if encoding not in PROMPT_ENCODINGS:
+        raise ValueError(f'Unknown prompt encoding: {encoding}')
+
+    introduction_str = (
+        "Act as a computer scientist cartographer and create a map "
+        "representation of an indoor building. I will provide you with 3 "
+        "things. First, the expected output format. Second, information about "
+        "the room-like regions of the building. We might have regions that "
+        "have the same name/label. Third, instructions for an agent to navigate "
+        "through the building. The navigation instructions are independent of "
+        "each other and they are not ordered. Also, please only focus on the "
+        "room-like regions of the building, and don't include any information "
+        "about the objects in it.\n\n"
+    )
+
+    introduction_str = "Create a connectivity Matrix from the following navigation instructions"
+    
+    output_format_str = (
+        "OUTPUT FORMAT: Return only a JSON object, I don't want any other "
+        "comments. The JSON contains one key named connectivity_graph which has "
+        "a value of a Python Dictionary. The dictionary contains a key for each "
+        "region index and the value for each key is a list of indices of regions "
+        "that are connected to it.\n\n"
+    )
+    
+    # Add Information about metadata of of the building
+    building_information = buildings_metadata[building_id]
+
+    # Add Navigation Instructions
+    building_navigation_instructions = text2map_navigation_instructions[building_id]
+    navigation_instructions = building_navigation_instructions[instruction_index]
+    
+    # navigation_instructions = navigation_instructions[:int(len(navigation_instructions) * 0.1)]
+
+    return assemble_prompt(introduction_str, output_format_str, building_information,
+        navigation_instructions, chatgpt_format, encoding)
+
+
+def assemble_prompt(introduction_str, output_format_str, building_information,
+    navigation_instructions, chatgpt_format, encoding):
+    """
+    Renders the regions and the navigation instructions in the encoding, and
+    combines them with the introduction and the output format.
+
+    Args:
+        building_information (dict): Levels of buildings_metadata to describe.
+        navigation_instructions (list(dict)): Instructions of the sequence.
+    """
+    if encoding == 'verbose':
+        regions_information_str = verbose_regions_information(building_information)
+    elif encoding == 'legend':
+        regions_information_str = legend_regions_information(building_information)
+    else:
+        regions_information_str = tabular_regions_information(building_information)
+
+    if encoding == 'verbose':
+        navigation_instructions_str = verbose_navigation_instructions(navigation_instructions)
+    else:
+        navigation_instructions_str = tabular_navigation_instructions(navigation_instructions)
+
     # Combine everything together
     if chatgpt_format:
         return introduction_str, output_format_str + navigation_instructions_str
         # return introduction_str, output_format_str + regions_information_str + navigation_instructions_str
     
     prompt = introduction_str + output_format_str + regions_information_str + navigation_instructions_str
-    return prompt
\ No newline at end of file
+    return prompt
+
+
+def regions_levels(building_id):
+    """
+    Returns:
+        dict: {region_index (int): level_index (str)}.
+    """
+    return {
+        int(region_idx): level
+        for level, level_information in buildings_metadata[building_id].items()
+        for region_idx in level_information['regions']
+    }
+
+
+def split_instructions_by_level(building_id, navigation_instructions):
+    """
+    Splits instructions into the ones that stay in one level, and the ones
+    that cross levels or start or end in a region without a level.
+
+    Returns:
+        (dict, list): {level_index (str): [instruction]}, [instruction].
+    """
+    levels = regions_levels(building_id)
+    level_instructions = {}
+    inter_level_instructions = []
+    for instruction in navigation_instructions:
+        start_level = levels.get(instruction['start_region'])
+        end_level = start_level if instruction['end_region'] == -1 else levels.get(instruction['end_region'])
+        if start_level is not None and start_level == end_level:
+            level_instructions.setdefault(start_level, []).append(instruction)
+        else:
+            inter_level_instructions.append(instruction)
+
+    return level_instructions, inter_level_instructions
+
+
+@profiled('prompt')
+def generate_level_prompt(building_id, instruction_index, level, chatgpt_format=True,
+    encoding=PROMPTER.ENCODING):
+    """
+    Generates the prompt of the regions of one level of a building, from the
+    instructions of the sequence that stay in that level.
+
+    Args:
+        building_id (str): Building to describe.
+        instruction_index (int): Index of the instructions sequence.
+        level (str): Index of the level.
+        chatgpt_format (bool, optional): Return (system, user) instead of a
+            single prompt. Defaults to True.
+        encoding (str, optional): One of PROMPT_ENCODINGS. Defaults to PROMPTER.ENCODING.
+
+    Returns:
+        (str, str) | str: (system, user) if chatgpt_format, otherwise the prompt.
+    """
+    if encoding not in PROMPT_ENCODINGS:
+        raise ValueError(f'Unknown prompt encoding: {encoding}')
+
+    introduction_str = (
+        f"Create a connectivity Matrix of the regions of level {level} from the "
+        "following navigation instructions"
+    )
+    output_format_str = (
+        "OUTPUT FORMAT: Return only a JSON object, I don't want any other "
+        "comments. The JSON contains one key named connectivity_graph which has "
+        "a value of a Python Dictionary. The dictionary contains a key for each "
+        "region index and the value for each key is a list of indices of regions "
+        "that are connected to it.\n\n"
+    )
+
+    building_information = {level: buildings_metadata[building_id][level]}
+    navigation_instructions = split_instructions_by_level(
+        building_id, text2map_navigation_instructions[building_id][instruction_index]
+    )[0].get(level, [])
+
+    return assemble_prompt(introduction_str, output_format_str, building_information,
+        navigation_instructions, chatgpt_format, encoding)
+
+
+@profiled('prompt')
+def generate_inter_level_prompt(building_id, instruction_index, chatgpt_format=True,
+    encoding=PROMPTER.ENCODING):
+    """
+    Generates the prompt of the connections between the levels of a building,
+    such as stairs, from the instructions of the sequence that cross levels.
+
+    Args:
+        building_id (str): Building to describe.
+        instruction_index (int): Index of the instructions sequence.
+        chatgpt_format (bool, optional): Return (system, user) instead of a
+            single prompt. Defaults to True.
+        encoding (str, optional): One of PROMPT_ENCODINGS. Defaults to PROMPTER.ENCODING.
+
+    Returns:
+        (str, str) | str: (system, user) if chatgpt_format, otherwise the prompt.
+    """
+    if encoding not in PROMPT_ENCODINGS:
+        raise ValueError(f'Unknown prompt encoding: {encoding}')
+
+    building_information = buildings_metadata[building_id]
+    introduction_str = (
+        "Find the connections between the levels of a building from the "
+        "following navigation instructions"
+    )
+    output_format_str = (
+        "OUTPUT FORMAT: Return only a JSON object, I don't want any other "
+        "comments. The JSON contains one key named connectivity_graph which has "
+        "a value of a Python Dictionary. The dictionary contains a key for each "
+        "region index connected to a region of another level and the value for "
+        "each key is a list of indices of the regions of other levels that are "
+        "connected to it.\n\n"
+        "LEVELS:\n"
+    )
+    for level, level_information in building_information.items():
+        output_format_str += f"Level {level}: regions {', '.join(level_information['regions'])}\n"
+    output_format_str += "\n"
+
+    navigation_instructions = split_instructions_by_level(
+        building_id, text2map_navigation_instructions[building_id][instruction_index]
+    )[1]
+
+    return assemble_prompt(introduction_str, output_format_str, building_information,
+        navigation_instructions, chatgpt_format, encoding)
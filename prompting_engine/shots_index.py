@@ -0,0 +1,167 @@
+import sys
+sys.path.append('../')
+
+from config import SHOTS
+from prompting_engine.prompter import buildings_metadata, regions_lables
+
+import os
+import json
+import math
+import pickle
+import hashlib
+import inspect
+
+
+"""
+Nearest-neighbor index of the buildings, used to pick few-shot examples that
+resemble the prompted building. The neighbors of every building are ranked
+once when the index is built, so a lookup is a slice of a list.
+"""
+# ------------------------------------------------------------------------------
+loaded_indices = {}
+# ------------------------------------------------------------------------------
+
+
+def building_features(building_id):
+    """
+    Features of the metadata of a building only. The connectivity graph of the
+    prompted building is the expected answer, so it is not used to rank shots.
+
+    Returns:
+        list(float): [number of regions, number of levels, fraction of the
+        regions of each label of regions_labels.json] of the building.
+    """
+    building_information = buildings_metadata[building_id]
+    labels = [
+        label
+        for level_information in building_information.values()
+        for label in level_information['regions'].values()
+    ]
+    num_regions = len(labels)
+    label_histogram = [labels.count(code) / max(1, num_regions) for code in regions_lables]
+
+    return [num_regions, len(building_information)] + label_histogram
+
+
+def inputs_digest(regions_connectivity_path):
+    """
+    Returns a sha256 hex digest of the connectivity file, of buildings_metadata
+    and of the code of building_features.
+    """
+    sha = hashlib.sha256()
+    sha.update(inspect.getsource(building_features).encode())
+    with open(regions_connectivity_path, 'rb') as file:
+        sha.update(file.read())
+    sha.update(json.dumps(buildings_metadata, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def standardize(features, mean, std):
+    return [(value - m) / s for value, m, s in zip(features, mean, std)]
+
+
+def distance(features_1, features_2):
+    return math.sqrt(sum((a - b) ** 2 for a, b in zip(features_1, features_2)))
+
+
+def build_shots_index(regions_connectivity_path, save_path=SHOTS.INDEX_PATH):
+    """
+    Computes the standardized metadata features of every building with a
+    ground-truth graph, the buildings that can be used as shots, and ranks the
+    other buildings by distance.
+
+    Args:
+        regions_connectivity_path (str): Path to the ground-truth connectivity.
+        save_path (str.pkl, optional): Path to save the index. Defaults to SHOTS.INDEX_PATH.
+
+    Returns:
+        dict: {
+            'digest': str (see inputs_digest),
+            'mean': [float], 'std': [float],
+            'features': {building_id (str): [float] (standardized)},
+            'neighbors': {building_id (str): [building_id (str)] (nearest first)}
+        }
+    """
+    with open(regions_connectivity_path, 'rb') as file:
+        regions_connectivity = pickle.load(file)
+
+    buildings = [building for building in regions_connectivity if building in buildings_metadata]
+    raw_features = [building_features(building) for building in buildings]
+
+    # Standardize every feature, constant features are left at 0
+    mean = [sum(column) / len(column) for column in zip(*raw_features)]
+    std = [
+        math.sqrt(sum((value - m) ** 2 for value in column) / len(column)) or 1
+        for column, m in zip(zip(*raw_features), mean)
+    ]
+    features = {
+        building: standardize(raw, mean, std)
+        for building, raw in zip(buildings, raw_features)
+    }
+
+    neighbors = {
+        building: sorted(
+            (other for other in buildings if other != building),
+            key=lambda other: (distance(features[building], features[other]), other)
+        )
+        for building in buildings
+    }
+
+    index = {
+        'digest': inputs_digest(regions_connectivity_path),
+        'mean': mean, 'std': std, 'features': features, 'neighbors': neighbors
+    }
+
+    # Save file
+    if save_path:
+        with open(save_path, 'wb') as pickle_file:
+            pickle.dump(index, pickle_file)
+
+    return index
+
+
+def load_shots_index(regions_connectivity_path, index_path=SHOTS.INDEX_PATH):
+    """
+    Loads the index from index_path. It is built again if it does not exist, or
+    if it was built from another connectivity file, buildings_metadata or
+    features.
+    """
+    digest = inputs_digest(regions_connectivity_path)
+    index = loaded_indices.get(index_path)
+    if index is None and os.path.exists(index_path):
+        with open(index_path, 'rb') as file:
+            index = pickle.load(file)
+    if index is None or index.get('digest') != digest:
+        index = build_shots_index(regions_connectivity_path, index_path)
+
+    loaded_indices[index_path] = index
+    return index
+
+
+def similar_buildings(index, building_id, k):
+    """
+    Returns the k buildings most similar to building_id, excluding itself.
+
+    Args:
+        index (dict): Index returned by build_shots_index.
+        building_id (str): Prompted building.
+        k (int): Number of buildings.
+
+    Returns:
+        list(str): Nearest first.
+
+    Raises:
+        ValueError: If there are fewer than k buildings to choose from.
+    """
+    if building_id in index['neighbors']:
+        neighbors = index['neighbors'][building_id]
+    else:
+        features = standardize(building_features(building_id), index['mean'], index['std'])
+        neighbors = sorted(
+            (other for other in index['features'] if other != building_id),
+            key=lambda other: (distance(features, index['features'][other]), other)
+        )
+
+    if len(neighbors) < k:
+        raise ValueError(f'{k} shots requested for {building_id}, only {len(neighbors)} buildings available')
+    return neighbors[:k]